@@ -1,31 +1,367 @@
-import requests
+import httpx
+import asyncio
 import hashlib
-from bs4 import BeautifulSoup
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
 from urllib.parse import (
-    urlparse, urlunparse, parse_qs, urlencode
+    urlparse, urlunparse, parse_qsl, urlencode
 )
 
+# Tags whose contents are never part of the page structure
+SKIPPED_TAGS = frozenset({"script", "style", "noscript", "template"})
+
+# SimHash fingerprints: width in bits, how many consecutive elements make up
+# one shingle, and how many differing bits still count as the same structure
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+SIMHASH_THRESHOLD = 3
+
+# Query parameters that only track the visitor and never change the page.
+# Stored lowercased, and matched case-insensitively
+TRACKING_PARAMS = frozenset({
+    "utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content",
+    "itm_source", "si", "trackingid", "refid", "midtoken", "midsig",
+    "trk", "trkemail", "eid", "otptoken", "fbclid", "gclid",
+})
+
+# One pooled HTTP/2 client for every fetch: requests to the same host are
+# multiplexed over a single TCP/TLS connection instead of one per request.
+# httpx builds Accept-Encoding from the decoders it can actually use: always
+# gzip/deflate, plus br and zstd once brotli and zstandard are installed
+# (pip install "httpx[http2,brotli,zstd]"). Those shrink large pages several
+# times over on the wire. Hard-coding "br, zstd" here would instead leave
+# undecoded bytes in the parser on machines without them
+# Connection failures are retried by the transport, so a dropped socket in
+# the pool doesn't turn into a failed comparison
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=5.0,
+    follow_redirects=True,
+)
+
+# How many pages each of the caches below remembers
+CACHE_SIZE = 4096
+
+# BLAKE2b digest of a raw response body -> fingerprint. A tracking-parameter
+# variant served byte-for-byte identical HTML needs no parse at all
+_RAW_INDEX = OrderedDict()
+
+# Hosts worth opening a connection to before the first real request
+WARM_HOSTS = ["www.linkedin.com"]
+
+# canonical url -> (ETag, Last-Modified, fingerprint) from the last full fetch.
+# Once a page drops out of the in-memory cache it is revalidated with a
+# conditional GET, and a 304 reuses the fingerprint without a body or parse
+_VALIDATORS = OrderedDict()
+
+# canonical url -> fingerprint of every page hashed so far, shared by
+# get_html_structure_hash and get_html_structure_hash_async
+_FINGERPRINTS = OrderedDict()
+
+# The caches are used from worker threads in both paths
+_CACHE_LOCK = threading.Lock()
+
+class _NotHTML(Exception):
+    """
+    Raised when a response has no HTML page in it to fingerprint.
+    """
+
+def _remember(index, key, value):
+    """
+    Stores key -> value in one of the bounded caches above, dropping the
+    entry stored longest ago once there are more than CACHE_SIZE.
+    """
+    with _CACHE_LOCK:
+        index[key] = value
+        index.move_to_end(key)
+        if len(index) > CACHE_SIZE:
+            index.popitem(last=False)
+
+def canonical(url: str) -> str:
+    """
+    Strips tracking parameters and the fragment (never sent to the server),
+    and sorts what's left, so URL variants of the same page share a cache key.
+    The kept parameters are re-encoded, exactly as urlencode would.
+    """
+    parsed = urlparse(url)
+    kept = [
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS
+    ]
+    return urlunparse(parsed._replace(query=urlencode(sorted(kept)), fragment=""))
+
+class _StructureCollector:
+    """
+    lxml parser target that SimHashes the page structure while the HTML is
+    being parsed. Every element becomes a "parent>tag.class#id" token, and
+    each run of SHINGLE_SIZE consecutive tokens is hashed into the bit counts
+    as soon as it's complete, so neither a tree nor a token list is kept.
+    Subtrees under SKIPPED_TAGS, text and comments are ignored.
+    """
+
+    def __init__(self):
+        self._open_tags = []
+        self._skip_depth = 0
+        self._window = deque(maxlen=SHINGLE_SIZE)
+        self._elements = 0
+        self._counts = [0] * SIMHASH_BITS
+
+    def start(self, tag, attrib):
+        if self._skip_depth or tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+            return
+        parent_tag = self._open_tags[-1] if self._open_tags else ""
+        self._window.append(f"{parent_tag}>{tag}.{attrib.get('class', '')}#{attrib.get('id', '')}")
+        self._open_tags.append(tag)
+        self._elements += 1
+        if len(self._window) == SHINGLE_SIZE:
+            self._add_shingle()
+
+    def end(self, tag):
+        if self._skip_depth:
+            self._skip_depth -= 1
+        elif self._open_tags:
+            self._open_tags.pop()
+
+    def data(self, data):
+        pass  # Text is not part of the structure
+
+    def _add_shingle(self):
+        shingle = " ".join(self._window).encode("utf-8")
+        value = int.from_bytes(hashlib.blake2b(shingle, digest_size=SIMHASH_BITS // 8).digest(), "little")
+        for bit in range(SIMHASH_BITS):
+            self._counts[bit] += 1 if value >> bit & 1 else -1
+
+    def close(self):
+        """
+        Returns the SimHash (every bit set that most shingle hashes have
+        set), or None if the document had no elements.
+        """
+        if not self._elements:
+            return None
+        # Pages with fewer elements than a shingle still get one
+        if self._elements < SHINGLE_SIZE:
+            self._add_shingle()
+
+        fingerprint = 0
+        for bit, count in enumerate(self._counts):
+            if count > 0:
+                fingerprint |= 1 << bit
+        return fingerprint
+
+def structures_match(hash_a: int, hash_b: int) -> bool:
+    """
+    Two SimHash fingerprints describe the same structure if their Hamming
+    distance is within SIMHASH_THRESHOLD.
+    """
+    return (hash_a ^ hash_b).bit_count() <= SIMHASH_THRESHOLD
+
+def _conditional_headers(url: str):
+    """
+    Returns the If-None-Match / If-Modified-Since headers for a URL fetched
+    before, along with its (ETag, Last-Modified, fingerprint) entry.
+    """
+    headers = {}
+    cached = _VALIDATORS.get(url)
+    if cached is not None:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    return headers, cached
+
+def _fingerprint_chunks(chunks):
+    """
+    Fingerprints a response body given as a list of byte chunks. A cheap
+    hash of the raw bytes is checked first: byte-identical bodies must have
+    the same structure, so only new bodies go through the structure collector.
+    """
+    raw = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        raw.update(chunk)
+    raw_key = raw.digest()
+    fingerprint = _RAW_INDEX.get(raw_key)
+    if fingerprint is not None:
+        return fingerprint
+
+    parser = etree.HTMLParser(target=_StructureCollector())
+    for chunk in chunks:
+        parser.feed(chunk)
+    fingerprint = parser.close()
+    if fingerprint is not None:
+        _remember(_RAW_INDEX, raw_key, fingerprint)
+    return fingerprint
+
+def _lookup(url: str):
+    """
+    The cache and validator lookup for a canonical URL, shared by the sync
+    and async paths. Returns (fingerprint, None, None) for a page hashed
+    before, or else (None, headers, cached): the conditional headers to
+    fetch it with, and its _VALIDATORS entry if it has one.
+    """
+    with _CACHE_LOCK:
+        fingerprint = _FINGERPRINTS.get(url)
+        if fingerprint is not None:
+            _FINGERPRINTS.move_to_end(url)
+            return fingerprint, None, None
+    headers, cached = _conditional_headers(url)
+    return None, headers, cached
+
+def _unchanged(response, cached) -> bool:
+    """
+    True if 'response' is a 304 confirming the 'cached' _VALIDATORS entry.
+    Otherwise raises for error pages and for anything that isn't HTML, so
+    the body is only read for an actual page.
+    """
+    if response.status_code == 304 and cached is not None:
+        return True
+    # Error pages are not the page we asked for, don't bother parsing them
+    response.raise_for_status()
+    if "html" not in response.headers.get("Content-Type", "html"):
+        raise _NotHTML(str(response.url))  # Not a page, so nothing to compare
+    return False
+
+def _store(url: str, response, fingerprint):
+    """
+    Caches 'fingerprint' for 'url' along with the response's validators,
+    and returns it. Raises _NotHTML if the body had no elements.
+    """
+    if fingerprint is None:
+        raise _NotHTML(url)  # A body without a single element
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        _remember(_VALIDATORS, url, (etag, last_modified, fingerprint))
+    _remember(_FINGERPRINTS, url, fingerprint)
+    return fingerprint
+
+def _hash_for_canonical(url: str):
+    """
+    Fetches and SimHashes the page structure for an already canonical URL.
+    Raises on failure, or _NotHTML if the URL isn't an HTML page, so that
+    neither is cached.
+    """
+    fingerprint, headers, cached = _lookup(url)
+    if fingerprint is not None:
+        return fingerprint
+
+    # Stream the body in raw chunks (never decoded to a str or joined into
+    # one bytes object), then parse only if no identical body was seen before
+    with _CLIENT.stream("GET", url, headers=headers) as response:
+        if _unchanged(response, cached):
+            return _store(url, response, cached[2])  # Unchanged since the last fetch
+        chunks = list(response.iter_bytes(chunk_size=64 * 1024))
+
+    return _store(url, response, _fingerprint_chunks(chunks))
+
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _FINGERPRINTS.clear()
+    _VALIDATORS.clear()
+    _RAW_INDEX.clear()
+
+def warm_connections(hosts=WARM_HOSTS):
+    """
+    Sends a HEAD to each host so DNS and the TLS handshake are done and a
+    keep-alive connection is sitting in the pool before the first real fetch.
+    Meant to be called once at startup; failures are ignored.
+    """
+    def warm(host):
+        try:
+            _CLIENT.head(f"https://{host}/")
+        except httpx.HTTPError:
+            pass
+
+    with ThreadPoolExecutor(max_workers=max(len(hosts), 1)) as executor:
+        list(executor.map(warm, hosts))
+
 def get_html_structure_hash(url):
+    """
+    Returns a SimHash of the page's tag structure (compare two with
+    structures_match), or None if it couldn't be fetched or isn't HTML.
+    Repeat calls for the same page (up to tracking parameters) are answered
+    from the cache without touching the network.
+    """
+    try:
+        return _hash_for_canonical(canonical(url))
+    except (httpx.HTTPError, etree.XMLSyntaxError, _NotHTML):
+        return None  # Return None if request fails (or returns 4xx/5xx, or no body)
+
+
+async def get_html_structure_hash_async(url, client):
+    """
+    Async counterpart of get_html_structure_hash, fetching with the given
+    httpx.AsyncClient. The body is parsed in a worker thread so that other
+    fetches keep going meanwhile. Returns None on failure or non-HTML.
+    """
+    url = canonical(url)
+    fingerprint, headers, cached = _lookup(url)
+    if fingerprint is not None:
+        return fingerprint
+
     try:
-        response = requests.get(url, timeout=5, allow_redirects=True)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        async with client.stream("GET", url, headers=headers) as response:
+            if _unchanged(response, cached):
+                return _store(url, response, cached[2])  # Unchanged since the last fetch
+            chunks = [chunk async for chunk in response.aiter_bytes(chunk_size=64 * 1024)]
+
+        fingerprint = await asyncio.to_thread(_fingerprint_chunks, chunks)
+        return _store(url, response, fingerprint)
+    except (httpx.HTTPError, etree.XMLSyntaxError, _NotHTML):
+        return None
+
+async def hash_many(urls, concurrency=32):
+    """
+    Fingerprints many URLs at once on a single HTTP/2 AsyncClient, with at
+    most 'concurrency' fetches in flight. Results are in the order of 'urls'.
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(http2=True, timeout=5.0, follow_redirects=True, limits=limits) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(url):
+            async with semaphore:
+                return await get_html_structure_hash_async(url, client)
+
+        return await asyncio.gather(*(one(url) for url in urls))
+
+def main():
+    # Compare two URLs
+    url1 = "https://www.linkedin.com/jobs/view/4072276680/?trackingId=HsJTLWIQTGO9o%2FE5pF0S%2Bw%3D%3D&refId=PRPmdWjWTCWNNRYk%2BP9JPw%3D%3D&midToken=AQGfdDCjrLGhkQ&midSig=1Lgo0gvQ3EMrA1&trk=eml-email_jobs_viewed_job_reminder_01-job_card-0-jobcard_body&trkEmail=eml-email_jobs_viewed_job_reminder_01-job_card-0-jobcard_body-null-gilcz4~m5zt912i~s3-null-null&eid=gilcz4-m5zt912i-s3&otpToken=MWIwYzE2ZTYxYTI2Y2RjZGIyMjQwNGVkNDUxOWU3YjI4ZmM3ZDg0MzllYWU4OTYxNzljNDA3Njk0NjVmNTlmMGZmZDBkZjllNzVmMGI5YzY3OWFjZWUwYjE4OTQ5NDI1YzYwOWU2ZGNjMzc2M2RjNjg4YmJmMiwxLDE%3D"
+    url2 = "https://www.linkedin.com/jobs/view/4072276680/"
+
+    # URLs that only differ by tracking parameters are the same page,
+    # no need to fetch anything
+    if canonical(url1) == canonical(url2):
+        print(True)
+        return
 
-        # Remove all text and only keep the structural elements
-        for tag in soup.find_all():
-            tag.string = ""  # Remove inner text
-        
-        structure = str(soup)
-        return hashlib.sha256(structure.encode("utf-8")).hexdigest()
+    # Open a connection to each host once up front, so two fetches from the
+    # same host share it instead of both handshaking at the same time
+    warm_connections({urlparse(url).hostname for url in (url1, url2)})
 
-    except requests.RequestException:
-        return None  # Return None if request fails
+    # The two fetches are independent, so overlap them on the client's pool
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        hash1, hash2 = executor.map(get_html_structure_hash, [url1, url2])
 
-# Compare two URLs
-url1 = "https://www.linkedin.com/jobs/view/4072276680/?trackingId=HsJTLWIQTGO9o%2FE5pF0S%2Bw%3D%3D&refId=PRPmdWjWTCWNNRYk%2BP9JPw%3D%3D&midToken=AQGfdDCjrLGhkQ&midSig=1Lgo0gvQ3EMrA1&trk=eml-email_jobs_viewed_job_reminder_01-job_card-0-jobcard_body&trkEmail=eml-email_jobs_viewed_job_reminder_01-job_card-0-jobcard_body-null-gilcz4~m5zt912i~s3-null-null&eid=gilcz4-m5zt912i-s3&otpToken=MWIwYzE2ZTYxYTI2Y2RjZGIyMjQwNGVkNDUxOWU3YjI4ZmM3ZDg0MzllYWU4OTYxNzljNDA3Njk0NjVmNTlmMGZmZDBkZjllNzVmMGI5YzY3OWFjZWUwYjE4OTQ5NDI1YzYwOWU2ZGNjMzc2M2RjNjg4YmJmMiwxLDE%3D"
-url2 = "https://www.linkedin.com/jobs/view/4072276680/"
+    # None means the page couldn't be fetched, which must not count as a match
+    if hash1 is None or hash2 is None:
+        print("Could not fetch both pages, structures not compared")
+        return
 
-print(get_html_structure_hash(url1) == get_html_structure_hash(url2))  # True if same structure
+    print(structures_match(hash1, hash2))  # True if same structure
 
-#returns an incorrect 'True' result if the request fails (e.g. No internet connection)
+#All jobs/view/ posting have same structure, leading to false  'True' outputs
 
-#All jobs/view/ posting have same structure, leading to false  'True' outputs
\ No newline at end of file
+if __name__ == "__main__":
+    main()
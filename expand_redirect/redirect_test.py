@@ -1,7 +1,33 @@
-import requests
-from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
+import httpx
+from ada_url import URL
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import re
 
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# How many of the example URLs main() processes at once
+MAX_WORKERS = 16
+
+# One pooled client for all the redirect expansions in main(). Short links
+# from the same service (the two bit.ly examples) and chains landing on a
+# host we already hit reuse its open connection, multiplexed over HTTP/2
+# where the server supports it. Connection failures get a couple of
+# retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+)
+
+# scheme://netloc path ?query #fragment, in one match
+_URL_RE = re.compile(r"^([^:/?#]+)://([^/?#]*)([^?#]*)(?:\?([^#]*))?(?:#(.*))?$", re.DOTALL)
+
 def normalize_url(url: str) -> str:
     """
     Basic URL normalization:
@@ -9,74 +35,120 @@ def normalize_url(url: str) -> str:
       2) Remove default ports (80 for HTTP, 443 for HTTPS) if present.
       3) Remove trailing slash if present in the path.
       4) Sort query parameters alphabetically (optional).
+
+    Parsing is done by ada (WHATWG URL parser, in C++), which already does
+    1) and 2) and normalises percent-encoding. An empty path becomes "/".
+    Input ada can't parse is returned unchanged.
     """
-    # Parse the URL
-    parsed = urlparse(url)
+    try:
+        parsed = URL(url)
+    except ValueError:
+        return url
 
-    # Lowercase scheme and netloc #THIS MAY BE DETREMENTENTAL
-    # many urls are case sensitive (True?)
-    scheme = parsed.scheme.lower()
-    netloc = parsed.netloc.lower()
+    # Remove trailing slash from path
+    path = parsed.pathname
+    if path.endswith("/") and len(path) > 1:
+        parsed.pathname = path.rstrip("/")
+
+    # Sort query parameters (optional, but often helpful)
+    if parsed.search:
+        parsed.search = "&".join(sorted(parsed.search[1:].split("&")))
+
+    return parsed.href
+
+# Pure function of the string, and the same URLs keep coming back from
+# expand_redirect, so remember recent results
+@lru_cache(maxsize=16384)
+def normalize_url_fast(url: str) -> str:
+    """
+    Same steps as normalize_url, but on plain strings from a single regex
+    match, with no URL parser involved at all. Unlike normalize_url, the
+    percent-encoding is kept exactly as it was in the input.
+    Falls back to normalize_url for anything without a "scheme://".
+    """
+    match = _URL_RE.match(url)
+    if not match:
+        return normalize_url(url)
+    scheme, netloc, path, query, fragment = match.groups()
+
+    # Lowercase scheme and netloc (same caveat as normalize_url)
+    scheme = scheme.lower()
+    netloc = netloc.lower()
 
     # Remove default ports from netloc
-    if (scheme == "http" and netloc.endswith(":80")):
-        netloc = netloc[:-3]  # remove :80
-    elif (scheme == "https" and netloc.endswith(":443")):
-        netloc = netloc[:-4]  # remove :443
+    if scheme == "http":
+        netloc = netloc.removesuffix(":80")
+    elif scheme == "https":
+        netloc = netloc.removesuffix(":443")
 
     # Remove trailing slash from path
-    path = parsed.path
-    if path.endswith("/") and len(path) > 1:
+    if len(path) > 1:
         path = path.rstrip("/")
 
-    # Sort query parameters (optional, but often helpful)
-    query_params = parse_qs(parsed.query, keep_blank_values=True)
-    # parse_qs returns a dict of {param: [value1, value2]} 
-    # We'll flatten them (assuming one value per param) for simplicity
-    sorted_query = sorted(query_params.items())
-    encoded_query = urlencode(sorted_query, doseq=True)
-
-    # Reconstruct the URL
-    normalized = urlunparse((
-        scheme,
-        netloc,
-        path,
-        parsed.params,
-        encoded_query,
-        parsed.fragment
-    ))
-    return normalized
+    # Sort query parameters, no decoding or re-encoding
+    if query:
+        query = "&".join(sorted(query.split("&")))
+
+    return f"{scheme}://{netloc}{path}{'?' + query if query else ''}{'#' + fragment if fragment else ''}"
 
 def remove_fragment(url: str) -> str:
     """
     This function removes the fragment from the URL.
     """
-    parsed = urlparse(url)
-    # Remove the fragment by setting it to an empty string
-    parsed = parsed._replace(fragment='')
-    # removing queries, MAY BE DETREMENTAL
-    parse = parsed._replace(query='')
-    # Reconstruct the URL without the fragment
-    url_without_fragment = urlunparse(parsed)
-    return url_without_fragment
-
-def expand_redirect(url: str, timeout=5) -> str:
+    # The first '#' always starts the fragment (an escaped one is "%23"),
+    # so just cut there. Most URLs have none and come back untouched
+    idx = url.find('#')
+    return url if idx < 0 else url[:idx]
+
+@lru_cache(maxsize=4096)
+def _final_url(url: str) -> str:
+    """
+    Returns where 'url' ends up after following redirects.
+    Raises on failure so that failed fetches are not cached.
+    """
+    # Many sites respond incorrectly to HEAD, so always GET. Streamed,
+    # only the headers are read and the body is never downloaded, so
+    # this costs the same as a HEAD
+    with _CLIENT.stream("GET", url) as response:
+        return str(response.url)
+
+def expand_redirect(url: str) -> str:
     """
     Follows redirects to get the final destination URL.
     Useful for short-link expansion or tracking final landing pages.
     """
     try:
-        response = requests.head(url, allow_redirects=True, timeout=timeout)
-        # Some sites respond incorrectly to HEAD, so fallback to GET if needed
-        if response.status_code in (405, 400, 403):
-            response = requests.get(url, allow_redirects=True, timeout=timeout)
-        final_url = response.url
-        return final_url
-    except requests.RequestException as e:
+        return _final_url(url)
+    except httpx.HTTPError as e:
         print(f"Error expanding redirect for {url}: {e}")
         # If there's an error, return the original URL or handle it as needed
         return url
-    
+
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _final_url.cache_clear()
+
+def process(url: str) -> dict:
+    """
+    Runs one URL through the pipeline, returning the URL after each step.
+    """
+    # 1) Normailise the URL 
+    normalized = normalize_url_fast(url)
+
+    # 2) Remove fragments
+    fragment_adjusted = remove_fragment(normalized)
+
+    # 3) Expand any redirects (short links, etc.)
+    expanded = expand_redirect(fragment_adjusted)
+
+    return {
+        "original": url,
+        "normalized": normalized,
+        "fragment_adjusted": fragment_adjusted,
+        "expanded": expanded,
+    }
 
 def main():
     # Some example URLs:
@@ -90,20 +162,16 @@ def main():
         "https://fortune.com/2025/01/08/trump-canada-us-merger-51st-state/?itm_source=parsely-api"
     ]
 
-    for original_url in test_urls:
-        print(f"\nOriginal URL: {original_url}")
-        
-        # 1) Normailise the URL 
-        normalized = normalize_url(original_url)
-        print(f" Normalized URL: {normalized}")
-
-        # 2) Remove fragments
-        fragment_adjusted = remove_fragment(normalized)
-        print(f" After removing fragements: {fragment_adjusted}")
+    # Every URL is independent and mostly waits on the network, so run them
+    # all at once. Results come back in input order and are printed after
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(process, test_urls))
 
-        # 3) Expand any redirects (short links, etc.)
-        expanded = expand_redirect(fragment_adjusted)
-        print(f" After redirect expansion: {expanded}")
+    for result in results:
+        print(f"\nOriginal URL: {result['original']}")
+        print(f" Normalized URL: {result['normalized']}")
+        print(f" After removing fragements: {result['fragment_adjusted']}")
+        print(f" After redirect expansion: {result['expanded']}")
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,33 @@
-import requests
-from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
+import httpx
+from ada_url import URL
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs
 import re
 
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# How many of the example URLs main() processes at once
+MAX_WORKERS = 16
+
+# One thread-safe client shared by the workers in main(), so expand_redirect
+# calls that reach a host already visited (a youtu.be link landing on
+# youtube.com, say) reuse its pooled connection rather than opening a new
+# one. Connection failures get a couple of retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+)
+
+# scheme://netloc path ?query #fragment, in one match
+_URL_RE = re.compile(r"^([^:/?#]+)://([^/?#]*)([^?#]*)(?:\?([^#]*))?(?:#(.*))?$", re.DOTALL)
+
 def normalize_url(url: str) -> str:
     """
     Basic URL normalization:
@@ -9,109 +35,165 @@ def normalize_url(url: str) -> str:
       2) Remove default ports (80 for HTTP, 443 for HTTPS) if present.
       3) Remove trailing slash if present in the path.
       4) Sort query parameters alphabetically (optional).
+
+    Parsing is done by ada (WHATWG URL parser, in C++), which already does
+    1) and 2) and normalises percent-encoding. An empty path becomes "/".
+    Input ada can't parse is returned unchanged.
     """
-    # Parse the URL
-    parsed = urlparse(url)
+    try:
+        parsed = URL(url)
+    except ValueError:
+        return url
+
+    # Remove trailing slash from path
+    path = parsed.pathname
+    if path.endswith("/") and len(path) > 1:
+        parsed.pathname = path.rstrip("/")
+
+    # Sort query parameters (optional, but often helpful)
+    if parsed.search:
+        parsed.search = "&".join(sorted(parsed.search[1:].split("&")))
+
+    return parsed.href
+
+# Pure function of the string, and the same URLs keep coming back from
+# expand_redirect, so remember recent results
+@lru_cache(maxsize=16384)
+def normalize_url_fast(url: str) -> str:
+    """
+    Same steps as normalize_url, but on plain strings from a single regex
+    match, with no URL parser involved at all. Unlike normalize_url, the
+    percent-encoding is kept exactly as it was in the input.
+    Falls back to normalize_url for anything without a "scheme://".
+    """
+    match = _URL_RE.match(url)
+    if not match:
+        return normalize_url(url)
+    scheme, netloc, path, query, fragment = match.groups()
 
-    # Lowercase scheme and netloc #THIS MAY BE DETREMENTENTAL
-    # many urls are case sensitive (True?)
-    scheme = parsed.scheme.lower()
-    netloc = parsed.netloc.lower()
+    # Lowercase scheme and netloc (same caveat as normalize_url)
+    scheme = scheme.lower()
+    netloc = netloc.lower()
 
     # Remove default ports from netloc
-    if (scheme == "http" and netloc.endswith(":80")):
-        netloc = netloc[:-3]  # remove :80
-    elif (scheme == "https" and netloc.endswith(":443")):
-        netloc = netloc[:-4]  # remove :443
+    if scheme == "http":
+        netloc = netloc.removesuffix(":80")
+    elif scheme == "https":
+        netloc = netloc.removesuffix(":443")
 
     # Remove trailing slash from path
-    path = parsed.path
-    if path.endswith("/") and len(path) > 1:
+    if len(path) > 1:
         path = path.rstrip("/")
 
-    # Sort query parameters (optional, but often helpful)
-    query_params = parse_qs(parsed.query, keep_blank_values=True)
-    # parse_qs returns a dict of {param: [value1, value2]} 
-    # We'll flatten them (assuming one value per param) for simplicity
-    sorted_query = sorted(query_params.items())
-    encoded_query = urlencode(sorted_query, doseq=True)
-
-    # Reconstruct the URL
-    normalized = urlunparse((
-        scheme,
-        netloc,
-        path,
-        parsed.params,
-        encoded_query,
-        parsed.fragment
-    ))
-    return normalized
-
-def expand_redirect(url: str, timeout=5) -> str:
+    # Sort query parameters, no decoding or re-encoding
+    if query:
+        query = "&".join(sorted(query.split("&")))
+
+    return f"{scheme}://{netloc}{path}{'?' + query if query else ''}{'#' + fragment if fragment else ''}"
+
+@lru_cache(maxsize=4096)
+def _final_url(url: str) -> str:
+    """
+    Returns where 'url' ends up after following redirects.
+    Raises on failure so that failed fetches are not cached.
+    """
+    # Many sites respond incorrectly to HEAD, so always GET. Streamed,
+    # only the headers are read and the body is never downloaded, so
+    # this costs the same as a HEAD
+    with _CLIENT.stream("GET", url) as response:
+        return str(response.url)
+
+def expand_redirect(url: str) -> str:
     """
     Follows redirects to get the final destination URL.
     Useful for short-link expansion or tracking final landing pages.
     """
     try:
-        response = requests.head(url, allow_redirects=True, timeout=timeout)
-        # Some sites respond incorrectly to HEAD, so fallback to GET if needed
-        if response.status_code in (405, 400, 403):
-            response = requests.get(url, allow_redirects=True, timeout=timeout)
-        final_url = response.url
-        return final_url
-    except requests.RequestException as e:
+        return _final_url(url)
+    except httpx.HTTPError as e:
         print(f"Error expanding redirect for {url}: {e}")
         # If there's an error, return the original URL or handle it as needed
         return url
 
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _final_url.cache_clear()
+
+# Leading run of characters that can appear in a YouTube video ID
+_YT_ID_RE = re.compile(r'[a-zA-Z0-9_-]+')
+
+_YT_HOSTS = frozenset({"youtube.com", "www.youtube.com", "m.youtube.com", "youtu.be"})
+
+def _youtube_rule(parsed) -> str:
+    """
+    Rebuilds a YouTube link as https://www.youtube.com/watch?v=VIDEO_ID,
+    or returns "" if no video ID can be found in it.
+    """
+    # Cases:
+    #   - youtube.com/watch?v=VIDEO_ID
+    #   - youtube.com/v/VIDEO_ID
+    #   - youtu.be/VIDEO_ID
+    #   - short links, embedded links, etc.
+    if parsed.path.startswith("/watch"):
+        # Typically: https://www.youtube.com/watch?v=VIDEO_ID
+        video_id = parse_qs(parsed.query).get("v", [""])[0]
+    elif parsed.path.startswith("/v/"):
+        # Typically: https://www.youtube.com/v/VIDEO_ID
+        video_id = parsed.path.split("/")[2]
+    elif parsed.netloc.lower() == "youtu.be":
+        # Typically: https://youtu.be/VIDEO_ID
+        # The video ID is in the first segment of the path
+        video_id = parsed.path.lstrip("/")
+    else:
+        # Fallback, in case we don't detect anything
+        return ""
+
+    # Keep only the valid part of the video ID
+    match = _YT_ID_RE.match(video_id)
+    if not match:
+        return ""
+    return f"https://www.youtube.com/watch?v={match.group(0)}"
+
+# Host -> handler returning the canonical URL, or "" to leave the URL as it is
+_DOMAIN_RULES = {host: _youtube_rule for host in _YT_HOSTS}
+
 def apply_domain_specific_rules(url: str) -> str:
     """
     Applies special or custom logic for known domains like YouTube, Twitter, etc.
     For example, parse out the YouTube video ID and rebuild a canonical URL.
     """
     parsed = urlparse(url)
-    domain = parsed.netloc.lower()
-
-    # Example for YouTube
-    if "youtube.com" in domain or "youtu.be" in domain:
-        # 1) Extract the video ID from different possible patterns
-        query_params = parse_qs(parsed.query)
-
-        # Regular expression to match a valid YouTube video ID
-        video_id_pattern = re.compile(r'^[a-zA-Z0-9_-]+')
-
-        # Cases:
-        #   - youtube.com/watch?v=VIDEO_ID
-        #   - youtube.com/v/VIDEO_ID
-        #   - youtu.be/VIDEO_ID
-        #   - short links, embedded links, etc.
-        if "youtube.com/watch" in parsed.path:
-            # Typically: https://www.youtube.com/watch?v=VIDEO_ID
-            video_id = query_params.get("v", [""])[0]
-        elif parsed.path.startswith("/v/"):
-            # Typically: https://www.youtube.com/v/VIDEO_ID
-            video_id = parsed.path.split("/")[2]
-        elif "youtu.be" in domain:
-            # Typically: https://youtu.be/VIDEO_ID
-            # The video ID is in the first segment of the path
-            video_id = parsed.path.lstrip("/")
-        else:
-            # Fallback, in case we don't detect anything
-            video_id = ""
-
-        # Validate and clean the video ID
-        if video_id:
-            # Extract only the valid part of the video ID
-            match = video_id_pattern.match(video_id)
-            if match:
-                video_id = match.group(0)
-                # Example canonical URL format:
-                canonical_youtube = f"https://www.youtube.com/watch?v={video_id}"
-                return canonical_youtube
+    rule = _DOMAIN_RULES.get(parsed.netloc.lower())
+    if rule is not None:
+        canonical = rule(parsed)
+        if canonical:
+            return canonical
 
     # For other domains, return the URL unchanged (or add more special cases)
     return url
 
+def process(url: str) -> dict:
+    """
+    Runs one URL through the pipeline, returning the URL after each step.
+    """
+    # 1) Expand any redirects (short links, etc.)
+    expanded = expand_redirect(url)
+
+    # 2) Apply domain-specific rules (e.g., for YouTube)
+    domain_adjusted = apply_domain_specific_rules(expanded)
+
+    # 3) Normalize the URL (lowercase, remove default ports, etc.)
+    normalized = normalize_url_fast(domain_adjusted)
+
+    return {
+        "original": url,
+        "expanded": expanded,
+        "domain_adjusted": domain_adjusted,
+        "normalized": normalized,
+    }
+
 def main():
     # Some example URLs:
     test_urls = [
@@ -122,20 +204,16 @@ def main():
       #  "https://www.EXAMPLE.com:443/path/?b=2&a=1#section"
     ]
 
-    for original_url in test_urls:
-        print(f"\nOriginal URL: {original_url}")
-        
-        # 1) Expand any redirects (short links, etc.)
-        expanded = expand_redirect(original_url)
-        print(f" After redirect expansion: {expanded}")
-
-        # 2) Apply domain-specific rules (e.g., for YouTube)
-        domain_adjusted = apply_domain_specific_rules(expanded)
-        print(f" After domain-specific rules: {domain_adjusted}")
+    # Every URL is independent and mostly waits on the network, so run them
+    # all at once. Results come back in input order and are printed after
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(process, test_urls))
 
-        # 3) Normalize the URL (lowercase, remove default ports, etc.)
-        normalized = normalize_url(domain_adjusted)
-        print(f" Final normalized URL: {normalized}")
+    for result in results:
+        print(f"\nOriginal URL: {result['original']}")
+        print(f" After redirect expansion: {result['expanded']}")
+        print(f" After domain-specific rules: {result['domain_adjusted']}")
+        print(f" Final normalized URL: {result['normalized']}")
 
 if __name__ == "__main__":
     main()
@@ -1,18 +1,51 @@
-import requests
-from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
+import httpx
+from functools import lru_cache
+from urllib.parse import urlparse, urlunparse
 
-def expand_redirect(url: str, timeout=5) -> str:
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# One pooled HTTP/2 client for every request: the candidate URLs all sit on
+# the same host, so they are multiplexed over a single TCP/TLS connection
+# instead of handshaking for each. Connection failures get a couple of
+# retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+)
+
+@lru_cache(maxsize=4096)
+def _final_url(url: str) -> str:
+    """
+    Returns where 'url' ends up after following redirects.
+    Raises on failure so that failed fetches are not cached.
+    """
+    # Use GET if HEAD might be blocked or doesn't provide final info.
+    # Only the final URL matters, so the body is never downloaded
+    with _CLIENT.stream("GET", url) as response:
+        return str(response.url)
+
+def expand_redirect(url: str) -> str:
     """
     Follows redirects to get the final destination URL.
     """
     try:
-        # Use GET if HEAD might be blocked or doesn't provide final info
-        response = requests.get(url, allow_redirects=True, timeout=timeout)
-        return response.url
-    except requests.RequestException as e:
+        return _final_url(url)
+    except httpx.HTTPError as e:
         print(f"Error expanding redirect for {url}: {e}")
         return url  # fallback to original
 
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _final_url.cache_clear()
+
 def confirm_same_destination(original_url: str, modified_url: str) -> bool:
     """
     Return True if original_url and modified_url resolve to the same final URL.
@@ -23,6 +56,26 @@ def confirm_same_destination(original_url: str, modified_url: str) -> bool:
     # You could also compare response codes, content hashes, etc. if you want to be safer.
     return original_final == modified_final
 
+def _split_url(parsed):
+    """
+    Splits a parsed URL into a fixed prefix (everything before '?'), the
+    raw "key=value" query pairs with their keys, and a fixed '#fragment'
+    suffix. Test URLs can then be built by joining a subset of the pairs,
+    instead of re-running urlencode/urlunparse for every candidate.
+    """
+    prefix = urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, "", ""))
+    suffix = "#" + parsed.fragment if parsed.fragment else ""
+    pairs = [pair for pair in parsed.query.split("&") if pair]
+    keys = [pair.split("=", 1)[0] for pair in pairs]
+    return prefix, pairs, keys, suffix
+
+def _join_url(prefix, pairs, keep, suffix) -> str:
+    """
+    Rebuilds the URL from _split_url's pieces, keeping pairs[i] where keep[i].
+    """
+    query = "&".join([pair for pair, kept in zip(pairs, keep) if kept])
+    return prefix + ("?" + query if query else "") + suffix
+
 def clean_tracking_params(url: str, removable_keys=None) -> str:
     """
     Removes known tracking/analytics query parameters from the URL.
@@ -35,42 +88,28 @@ def clean_tracking_params(url: str, removable_keys=None) -> str:
         removable_keys = ["utm_source", "utm_medium", "utm_campaign", "itm_source", "utm_term", "utm_content"]
 
     parsed = urlparse(url)
-    query_params = parse_qs(parsed.query, keep_blank_values=True)
-
-    # We'll build a mutable dict from query_params
-    cleaned_params = dict(query_params)  # copy so we can remove keys
+    prefix, pairs, keys, suffix = _split_url(parsed)
+    keep = [True] * len(pairs)
 
-    for key in list(cleaned_params.keys()):
+    # Each key is tried once, removing all of its occurrences together
+    for key in dict.fromkeys(keys):
         if key in removable_keys:
             # Temporarily remove this key
-            removed_value = cleaned_params.pop(key)
-            
+            positions = [i for i, k in enumerate(keys) if k == key]
+            for i in positions:
+                keep[i] = False
+
             # Rebuild the "trimmed" URL
-            trimmed_query = urlencode(cleaned_params, doseq=True)
-            trimmed_url = urlunparse((
-                parsed.scheme,
-                parsed.netloc,
-                parsed.path,
-                parsed.params,
-                trimmed_query,
-                parsed.fragment
-            ))
-            
+            trimmed_url = _join_url(prefix, pairs, keep, suffix)
+
             # Check if it still leads to the same final destination
             if not confirm_same_destination(url, trimmed_url):
                 # If it's different, restore the parameter
-                cleaned_params[key] = removed_value
-    
+                for i in positions:
+                    keep[i] = True
+
     # Build the final cleaned URL
-    final_query = urlencode(cleaned_params, doseq=True)
-    cleaned_url = urlunparse((
-        parsed.scheme,
-        parsed.netloc,
-        parsed.path,
-        parsed.params,
-        final_query,
-        parsed.fragment
-    ))
+    cleaned_url = _join_url(prefix, pairs, keep, suffix)
     return cleaned_url
 
 def main():
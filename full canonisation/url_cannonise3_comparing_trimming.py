@@ -1,19 +1,52 @@
-import requests
-from urllib.parse import (
-    urlparse, urlunparse, parse_qs, urlencode
+import httpx
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import urlparse
+
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# One pooled HTTP/2 client for every request: the candidate URLs all sit on
+# the same host, so they are multiplexed over a single TCP/TLS connection
+# instead of handshaking for each. Connection failures get a couple of
+# retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
 )
 
-def expand_redirect(url: str, timeout=5) -> str:
+@lru_cache(maxsize=4096)
+def _final_url(url: str) -> str:
+    """
+    Returns where 'url' ends up after following redirects.
+    Raises on failure so that failed fetches are not cached.
+    """
+    # Only the final URL matters, so the body is never downloaded
+    with _CLIENT.stream("GET", url) as response:
+        return str(response.url)
+
+def expand_redirect(url: str) -> str:
     """
     Follows redirects to get the final destination URL.
     """
     try:
-        response = requests.get(url, allow_redirects=True, timeout=timeout)
-        return response.url
-    except requests.RequestException:
+        return _final_url(url)
+    except httpx.HTTPError:
         # If there's any error connecting, just return the original
         return url
 
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _final_url.cache_clear()
+
 def confirm_same_destination(original_url: str, test_url: str) -> bool:
     """
     Return True if original_url and test_url ultimately resolve to the same final URL.
@@ -22,61 +55,86 @@ def confirm_same_destination(original_url: str, test_url: str) -> bool:
     test_final = expand_redirect(test_url)
     return original_final == test_final
 
+@dataclass(slots=True)
+class URLParts:
+    """
+    A parsed URL as plain mutable strings, so the steps below can edit it in
+    place instead of allocating a new namedtuple for every candidate.
+    """
+    scheme: str
+    netloc: str
+    path: str
+    params: str
+    query: str
+    fragment: str
+
+def _emit(p: URLParts, query: Optional[str] = None, fragment: Optional[str] = None) -> str:
+    """
+    Formats 'p' back into a URL, optionally with a different query or fragment.
+    """
+    query = p.query if query is None else query
+    fragment = p.fragment if fragment is None else fragment
+    return (
+        f"{p.scheme + ':' if p.scheme else ''}{'//' + p.netloc if p.netloc else ''}"
+        f"{p.path}{';' + p.params if p.params else ''}"
+        f"{'?' + query if query else ''}{'#' + fragment if fragment else ''}"
+    )
+
 def make_url_canonical(url: str) -> str:
     """
     Attempt to remove the fragment, trailing slash, and query parameters
     without changing the final destination page. Return the shortest safe URL.
     """
-    parsed = urlparse(url)
+    p = URLParts(*urlparse(url))
 
     # ---------------------------------------------------------
     # STEP 1: Try removing the fragment if it exists
     # ---------------------------------------------------------
-    if parsed.fragment:
-        no_fragment_parsed = parsed._replace(fragment="")
-        no_fragment_url = urlunparse(no_fragment_parsed)
-        
-        if confirm_same_destination(url, no_fragment_url):
+    if p.fragment:
+        if confirm_same_destination(url, _emit(p, fragment="")):
             # Safe to remove the fragment
-            parsed = no_fragment_parsed
+            p.fragment = ""
 
     # ---------------------------------------------------------
     # STEP 2: Try removing a trailing slash from the path if present
     # ---------------------------------------------------------
-    if parsed.path.endswith("/") and parsed.path != "/":
-        trimmed_path = parsed.path.rstrip("/")
-        no_slash_parsed = parsed._replace(path=trimmed_path)
-        no_slash_url = urlunparse(no_slash_parsed)
-        
-        if confirm_same_destination(url, no_slash_url):
-            # Safe to remove trailing slash
-            parsed = no_slash_parsed
+    if p.path.endswith("/") and p.path != "/":
+        full_path = p.path
+        p.path = full_path.rstrip("/")
+
+        if not confirm_same_destination(url, _emit(p)):
+            # Removing it changes the destination, keep the trailing slash
+            p.path = full_path
 
     # ---------------------------------------------------------
     # STEP 3: Try removing each query parameter if it doesn't affect the final page
     # ---------------------------------------------------------
-    original_query = parse_qs(parsed.query, keep_blank_values=True)
-    
-    # We'll build a mutable dict from query_params
-    cleaned_params = dict(original_query)  # copy for safe iteration
+    # Work on the raw "key=value" pairs, so a test URL is just a join of
+    # the kept pairs rather than a fresh urlencode of the whole query
+    pairs = [pair for pair in p.query.split("&") if pair]
+    keys = [pair.split("=", 1)[0] for pair in pairs]
+    keep = [True] * len(pairs)
 
-    for key in list(cleaned_params.keys()):
+    # Each key is tried once, removing all of its occurrences together
+    for key in dict.fromkeys(keys):
         # Temporarily remove this key (and its values)
-        removed_value = cleaned_params.pop(key)
+        positions = [i for i, k in enumerate(keys) if k == key]
+        for i in positions:
+            keep[i] = False
 
         # Rebuild the "test" URL without the key
-        test_parsed = parsed._replace(query=urlencode(cleaned_params, doseq=True))
-        test_url = urlunparse(test_parsed)
+        test_query = "&".join([pair for pair, kept in zip(pairs, keep) if kept])
+        test_url = _emit(p, query=test_query)
 
         # Check if final destinations match
         if not confirm_same_destination(url, test_url):
             # If it changes the destination, restore the parameter
-            cleaned_params[key] = removed_value
+            for i in positions:
+                keep[i] = True
 
     # Rebuild the final cleaned URL
-    final_parsed = parsed._replace(query=urlencode(cleaned_params, doseq=True))
-    cleaned_url = urlunparse(final_parsed)
-    return cleaned_url
+    p.query = "&".join([pair for pair, kept in zip(pairs, keep) if kept])
+    return _emit(p)
 
 def main():
     original_url = "https://fortune.com/2025/01/08/trump-canada-us-merger-51st-state/?itm_source=parsely-api"
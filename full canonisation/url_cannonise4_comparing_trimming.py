@@ -1,17 +1,64 @@
-import requests
-from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlparse, urlunparse
+
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# One pooled HTTP/2 client for every request: the candidate URLs all sit on
+# the same host, so they are multiplexed over a single TCP/TLS connection
+# instead of handshaking for each. Connection failures get a couple of
+# retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+)
+
+# Query parameters that only track the visitor, tried for removal in order
+TRACKING_PARAMS = [
+    "utm_source", "utm_medium", "utm_campaign",
+    "utm_term", "utm_content", "itm_source",
+    # Add more if needed
+]
+
+# Same names, for membership tests on raw query keys
+TRACKING_SET = frozenset(TRACKING_PARAMS)
+
+# How many candidate URLs are fetched at once when canonicalising
+PREFETCH_WORKERS = 8
+
+@lru_cache(maxsize=4096)
+def _final_url(url: str) -> str:
+    """
+    Returns where 'url' ends up after following redirects.
+    Raises on failure so that failed fetches are not cached.
+    """
+    # Only the final URL matters, so the body is never downloaded
+    with _CLIENT.stream("GET", url) as resp:
+        return str(resp.url)
 
-def expand_redirect(url: str, timeout=5) -> str:
+def expand_redirect(url: str) -> str:
     """
     Follows redirects (HTTP 3xx) to get the final landing URL.
     Returns that final URL as a string.
     """
     try:
-        resp = requests.get(url, allow_redirects=True, timeout=timeout)
-        return resp.url
-    except requests.RequestException:
+        return _final_url(url)
+    except httpx.HTTPError:
         return url  # fallback if there's a network error
 
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _final_url.cache_clear()
+
 def urls_equivalent(url_a: str, url_b: str) -> bool:
     """
     Determines if url_a and url_b point to the 'same' final destination
@@ -47,6 +94,55 @@ def urls_equivalent(url_a: str, url_b: str) -> bool:
 
     return (same_scheme and same_netloc and same_path and same_query)
 
+def _query_pairs(query: str) -> list:
+    """
+    Splits a raw query string into (key, "key=value") pairs. Each pair is
+    kept exactly as written, so rebuilding the query never re-encodes it.
+    """
+    return [(kv.split("=", 1)[0], kv) for kv in query.split("&") if kv]
+
+def _join_pairs(pairs) -> str:
+    """
+    Rebuilds a raw query string from _query_pairs output.
+    """
+    return "&".join(kv for _, kv in pairs)
+
+def _strip_tracking(query: str) -> str:
+    """
+    Drops every TRACKING_PARAMS pair from a raw query string in one pass,
+    leaving the other pairs exactly as they were written.
+    """
+    return "&".join(kv for kv in query.split("&") if kv and kv.split("=", 1)[0] not in TRACKING_SET)
+
+def _speculative_candidates(url: str) -> list:
+    """
+    Lists every URL canonicalize_url will probe, assuming each removal
+    turns out to be safe. Fetching these all at once up front means the
+    sequential checks below mostly hit the cache instead of the network.
+    The one-by-one tracking probes are left out, since they are only
+    needed when stripping every tracking parameter at once fails.
+    """
+    parsed = urlparse(url)
+    candidates = [url]
+    if parsed.fragment:
+        parsed = parsed._replace(fragment="")
+        candidates.append(urlunparse(parsed))
+    if parsed.path.endswith("/") and parsed.path != "/":
+        parsed = parsed._replace(path=parsed.path.rstrip("/"))
+        candidates.append(urlunparse(parsed))
+
+    stripped_query = _strip_tracking(parsed.query)
+    if stripped_query != parsed.query:
+        candidates.append(urlunparse(parsed._replace(query=stripped_query)))
+    return candidates
+
+def _prefetch(urls) -> None:
+    """
+    Fills the _final_url cache for all 'urls' concurrently.
+    """
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        list(executor.map(expand_redirect, urls))
+
 def canonicalize_url(url: str) -> str:
     """
     Attempts to remove fragments, trailing slashes, and suspected 'tracking' parameters
@@ -54,6 +150,11 @@ def canonicalize_url(url: str) -> str:
     Returns the 'shortest' possible URL that leads to the same final page.
     """
 
+    # The probes are independent network round trips: run them all
+    # concurrently first, then walk through the checks in order as before.
+    # If a removal gets rejected, the later probes differ and are fetched then
+    _prefetch(_speculative_candidates(url))
+
     parsed = urlparse(url)
 
     # -----------------------------
@@ -81,34 +182,34 @@ def canonicalize_url(url: str) -> str:
             parsed = test_parsed
 
     # -----------------------------
-    # 3) Remove "known" tracking parameters, one by one
-    #    (utm_..., itm_source, etc.)
+    # 3) Remove "known" tracking parameters (utm_..., itm_source, etc.)
     # -----------------------------
-    remove_candidates = [
-        "utm_source", "utm_medium", "utm_campaign",
-        "utm_term", "utm_content", "itm_source",
-        # Add more if needed
-    ]
 
-    # parse_qs returns dict of {param -> [value1, value2, ...]}
-    query_params = parse_qs(parsed.query, keep_blank_values=True)
+    # These practically never change the page, so first try dropping them
+    # all at once: a single check instead of one per parameter
+    stripped_query = _strip_tracking(parsed.query)
+    if stripped_query != parsed.query:
+        stripped_parsed = parsed._replace(query=stripped_query)
+        if urls_equivalent(url, urlunparse(stripped_parsed)):
+            return urlunparse(stripped_parsed)
+
+    # Otherwise at least one of them matters: try them one by one
+    pairs = _query_pairs(parsed.query)
 
     # We'll attempt to remove each candidate param and check if the final is still the same
-    for param in remove_candidates:
-        if param in query_params:
-            saved_value = query_params.pop(param)  # remove it
-            test_query = urlencode(query_params, doseq=True)
-            test_parsed = parsed._replace(query=test_query)
+    for param in TRACKING_PARAMS:
+        trimmed = [pair for pair in pairs if pair[0] != param]
+        if len(trimmed) != len(pairs):
+            test_parsed = parsed._replace(query=_join_pairs(trimmed))
             test_url = urlunparse(test_parsed)
 
-            if not urls_equivalent(url, test_url):
-                # The final page changed or is detected as different,
-                # so restore the parameter
-                query_params[param] = saved_value
+            # If the final page changed or is detected as different,
+            # the parameter stays
+            if urls_equivalent(url, test_url):
+                pairs = trimmed
 
     # Rebuild final query
-    final_query = urlencode(query_params, doseq=True)
-    final_parsed = parsed._replace(query=final_query)
+    final_parsed = parsed._replace(query=_join_pairs(pairs))
     canonical_url = urlunparse(final_parsed)
 
     return canonical_url
@@ -1,45 +1,99 @@
-import requests
-from bs4 import BeautifulSoup
+import httpx
+import hashlib
+import html
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from urllib.parse import (
-    urlparse, urlunparse, parse_qs, urlencode
+    urlparse, urlunparse, urljoin
 )
 
-def fetch_content_signature(url: str, timeout=5):
-    """
-    Fetch the given URL (following redirects), parse the final HTML, and
-    return a 'signature' that represents the page content.
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# One pooled HTTP/2 client for every request: the candidate URLs all sit on
+# the same host, so they are multiplexed over a single TCP/TLS connection
+# instead of handshaking for each. Connection failures get a couple of
+# retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+)
 
-    For demonstration, we'll include:
-      - final_url (the last redirect location)
-      - status_code
-      - the <title> text (if any)
-      - (optionally) a content hash of the HTML
+# Query parameters that only track the visitor, tried for removal in order
+TRACKING_PARAMS = [
+    "utm_source", "utm_medium", "utm_campaign",
+    "utm_term", "utm_content", "itm_source",
+    # etc.
+]
 
-    You can modify this to suit your definition of "same page."
-    """
-    try:
-        response = requests.get(url, timeout=timeout, allow_redirects=True)
-        final_url = response.url
-        status_code = response.status_code
+# How many candidate URLs are fetched at once when canonicalising
+PREFETCH_WORKERS = 8
 
-        # Parse some or all of the HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
+# <link rel="canonical" href="..."> in the raw HTML, with its attributes in
+# either order
+_CANONICAL_LINK_RE = re.compile(rb"<link\b[^>]*\brel\s*=\s*[\"']?canonical\b[^>]*>", re.IGNORECASE)
+_HREF_RE = re.compile(rb"\bhref\s*=\s*[\"']?([^\"'\s>]+)", re.IGNORECASE)
 
-        # Extract the page title
-        title = soup.title.string.strip() if soup.title and soup.title.string else ""
+def _extract_canonical_link(resp) -> str:
+    """
+    Returns the absolute URL the page declares as its canonical form, or "".
+    """
+    tag = _CANONICAL_LINK_RE.search(resp.content)
+    if not tag:
+        return ""
+    href = _HREF_RE.search(tag.group(0))
+    if not href:
+        return ""
+    return urljoin(str(resp.url), html.unescape(href.group(1).decode(resp.encoding or "utf-8", "replace")))
+
+@lru_cache(maxsize=4096)
+def _fetch_page(url: str) -> tuple:
+    """
+    Fetch the given URL (following redirects) once and return
+    (signature, canonical). 'signature' represents the page content:
+    (status_code, SHA-256 of the body). 'canonical' is the page's
+    <link rel="canonical"> URL, or "" if it declares none.
+    Raises on failure so that failed fetches are not cached.
+
+    Two URLs are "the same page" only if they serve byte-identical bodies.
+    sha256 goes through OpenSSL, which uses the CPU's SHA instructions where
+    available, so hashing a whole page costs less than parsing it would.
+    """
+    response = _CLIENT.get(url)
+    signature = (response.status_code, hashlib.sha256(response.content).digest())
+    return (signature, _extract_canonical_link(response))
 
-        # Optionally, do a hash of the entire HTML if you want to be thorough
-        # import hashlib
-        # content_hash = hashlib.sha256(response.text.encode('utf-8')).hexdigest()
+def fetch_content_signature(url: str):
+    """
+    Returns the content signature from _fetch_page, or None if the page
+    couldn't be fetched.
+    """
+    try:
+        return _fetch_page(url)[0]
+    except httpx.HTTPError:
+        return None
 
-        # Return your chosen signature. For now, let's do:
-        #   (status_code, final_url, title)
-        # If two pages have the same final_url, status_code, and <title>, we'll call them "the same."
-        return (status_code, final_url, title)
+def declared_canonical(url: str) -> str:
+    """
+    Returns the <link rel="canonical"> URL from _fetch_page, or "" if the
+    page declares none or couldn't be fetched.
+    """
+    try:
+        return _fetch_page(url)[1]
+    except httpx.HTTPError:
+        return ""
 
-    except requests.RequestException:
-        # If there's a connection error, fallback to something that won't match easily
-        return (None, None, None)
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _fetch_page.cache_clear()
 
 def pages_equivalent(url_a: str, url_b: str) -> bool:
     """
@@ -48,7 +102,51 @@ def pages_equivalent(url_a: str, url_b: str) -> bool:
     """
     sig_a = fetch_content_signature(url_a)
     sig_b = fetch_content_signature(url_b)
-    return sig_a == sig_b
+    # A page that couldn't be fetched proves nothing, so it never matches
+    return sig_a is not None and sig_a == sig_b
+
+def _query_pairs(query: str) -> list:
+    """
+    Splits a raw query string into (key, "key=value") pairs. Each pair is
+    kept exactly as written, so rebuilding the query never re-encodes it.
+    """
+    return [(kv.split("=", 1)[0], kv) for kv in query.split("&") if kv]
+
+def _join_pairs(pairs) -> str:
+    """
+    Rebuilds a raw query string from _query_pairs output.
+    """
+    return "&".join(kv for _, kv in pairs)
+
+def _speculative_candidates(url: str) -> list:
+    """
+    Lists every URL canonicalize_url will probe, assuming each removal
+    turns out to be safe. Fetching these all at once up front means the
+    sequential checks below mostly hit the cache instead of the network.
+    """
+    parsed = urlparse(url)
+    candidates = [url]
+    if parsed.fragment:
+        parsed = parsed._replace(fragment="")
+        candidates.append(urlunparse(parsed))
+    if parsed.path.endswith("/") and parsed.path != "/":
+        parsed = parsed._replace(path=parsed.path.rstrip("/"))
+        candidates.append(urlunparse(parsed))
+
+    pairs = _query_pairs(parsed.query)
+    for param in TRACKING_PARAMS:
+        trimmed = [pair for pair in pairs if pair[0] != param]
+        if len(trimmed) != len(pairs):
+            pairs = trimmed
+            candidates.append(urlunparse(parsed._replace(query=_join_pairs(pairs))))
+    return candidates
+
+def _prefetch(urls) -> None:
+    """
+    Fills the _fetch_page cache for all 'urls' concurrently.
+    """
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        list(executor.map(fetch_content_signature, urls))
 
 def canonicalize_url(url: str) -> str:
     """
@@ -57,6 +155,17 @@ def canonicalize_url(url: str) -> str:
     rather than just final URL strings.
     """
 
+    # Most sites name their canonical URL in <link rel="canonical">. When the
+    # page does, and it stays on the same host, trust it and skip the probing
+    canonical = declared_canonical(url)
+    if canonical and urlparse(canonical).hostname == urlparse(url).hostname:
+        return canonical
+
+    # The probes are independent network round trips: run them all
+    # concurrently first, then walk through the checks in order as before.
+    # If a removal gets rejected, the later probes differ and are fetched then
+    _prefetch(_speculative_candidates(url))
+
     parsed = urlparse(url)
 
     # 1) Remove the fragment if possible
@@ -74,28 +183,20 @@ def canonicalize_url(url: str) -> str:
             parsed = without_slash
 
     # 3) Remove known tracking parameters, one by one
-    tracking_params = [
-        "utm_source", "utm_medium", "utm_campaign",
-        "utm_term", "utm_content", "itm_source",
-        # etc.
-    ]
-
-    query_dict = parse_qs(parsed.query, keep_blank_values=True)
-    for param in tracking_params:
-        if param in query_dict:
-            removed_value = query_dict.pop(param)
-            test_query = urlencode(query_dict, doseq=True)
-            test_parsed = parsed._replace(query=test_query)
+
+    pairs = _query_pairs(parsed.query)
+    for param in TRACKING_PARAMS:
+        trimmed = [pair for pair in pairs if pair[0] != param]
+        if len(trimmed) != len(pairs):
+            test_parsed = parsed._replace(query=_join_pairs(trimmed))
             test_url = urlunparse(test_parsed)
 
-            # Compare page content
-            if not pages_equivalent(url, test_url):
-                # Revert if the content differs
-                query_dict[param] = removed_value
+            # Compare page content, keeping the param if it differs
+            if pages_equivalent(url, test_url):
+                pairs = trimmed
 
     # Rebuild final canonical URL
-    final_query = urlencode(query_dict, doseq=True)
-    final_parsed = parsed._replace(query=final_query)
+    final_parsed = parsed._replace(query=_join_pairs(pairs))
     return urlunparse(final_parsed)
 
 def main():
@@ -113,7 +214,7 @@ def main():
     print("\nOriginal URL signature:", sig_original)
     print("Shortest URL signature:", sig_short)
 
-    if sig_original == sig_short:
+    if pages_equivalent(original_url, short_url):
         print("\nThey appear to be the same content.")
     else:
         print("\nThey appear to differ in some way.")
@@ -1,24 +1,172 @@
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
+import httpx
+import hashlib
+import html
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlparse, urlunparse, urljoin
 
-def fetch_content_signature(url: str, timeout=5):
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# One pooled HTTP/2 client for every request: the candidate URLs all sit on
+# the same host, so they are multiplexed over a single TCP/TLS connection
+# instead of handshaking for each. Connection failures get a couple of
+# retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+)
+
+# Query parameters that only track the visitor, tried for removal in order
+TRACKING_PARAMS = [
+    "utm_source", "utm_medium", "utm_campaign",
+    "utm_term", "utm_content", "itm_source", "si", "originalSubdomain", "trackingId", "refId", "midToken", "trkEmail", "otpToken",
+    "midSig", "trk", "eid", "ref", "cmp", "src", "mc_eid", "mc_cid", "mc_lid", "mc_mid", "mc_rid", "mc_t", "mc_uid", "mc_lid", "mc_eid", "mc_cid",
+    # ...
+]
+
+# How many candidate URLs are fetched at once when canonicalising
+PREFETCH_WORKERS = 8
+
+# Page markup that says nothing about which page this is: scripts and styles
+# (often with per-request nonces or tokens) and site-wide navigation
+_BOILERPLATE_RE = re.compile(rb"<(script|style|noscript|nav)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_MAIN_RE = re.compile(rb"<main\b[^>]*>(.*?)</main\s*>", re.IGNORECASE | re.DOTALL)
+_BODY_RE = re.compile(rb"<body\b[^>]*>(.*)", re.IGNORECASE | re.DOTALL)
+
+def _content_fingerprint(body: bytes) -> bytes:
+    """
+    BLAKE2b digest of the page's own content: the <main> element if there
+    is one, otherwise <body>, with _BOILERPLATE_RE removed.
+    """
+    match = _MAIN_RE.search(body) or _BODY_RE.search(body)
+    if match:
+        body = match.group(1)
+    return hashlib.blake2b(_BOILERPLATE_RE.sub(b"", body), digest_size=16).digest()
+
+# <link rel="canonical" href="..."> in the raw HTML, with its attributes in
+# either order
+_CANONICAL_LINK_RE = re.compile(rb"<link\b[^>]*\brel\s*=\s*[\"']?canonical\b[^>]*>", re.IGNORECASE)
+_HREF_RE = re.compile(rb"\bhref\s*=\s*[\"']?([^\"'\s>]+)", re.IGNORECASE)
+
+def _extract_canonical_link(resp) -> str:
+    """
+    Returns the absolute URL the page declares as its canonical form, or "".
+    """
+    tag = _CANONICAL_LINK_RE.search(resp.content)
+    if not tag:
+        return ""
+    href = _HREF_RE.search(tag.group(0))
+    if not href:
+        return ""
+    return urljoin(str(resp.url), html.unescape(href.group(1).decode(resp.encoding or "utf-8", "replace")))
+
+@lru_cache(maxsize=4096)
+def _fetch_page(url: str) -> tuple:
+    """
+    Fetches 'url' once and returns (signature, canonical): the
+    (status_code, content fingerprint) signature, and the page's
+    <link rel="canonical"> URL or "" if it declares none.
+    Raises on failure so that failed fetches are not cached.
+    """
+    resp = _CLIENT.get(url)
+    status_code = resp.status_code
+    fingerprint = _content_fingerprint(resp.content)
+    return ((status_code, fingerprint), _extract_canonical_link(resp))
+
+def fetch_content_signature(url: str):
+    """
+    Returns the content signature from _fetch_page, or None if the page
+    couldn't be fetched.
+    """
     try:
-        resp = requests.get(url, allow_redirects=True, timeout=timeout)
-        status_code = resp.status_code
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        title = soup.title.string.strip() if soup.title and soup.title.string else ""
-        # If you want to be more certain, do a content hash or parse <link rel="canonical">
-        return (status_code, title)
-    except requests.RequestException:
-        return (None, "")
+        return _fetch_page(url)[0]
+    except httpx.HTTPError:
+        return None
+
+def declared_canonical(url: str) -> str:
+    """
+    Returns the <link rel="canonical"> URL from _fetch_page, or "" if the
+    page declares none or couldn't be fetched.
+    """
+    try:
+        return _fetch_page(url)[1]
+    except httpx.HTTPError:
+        return ""
+
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _fetch_page.cache_clear()
 
 def pages_equivalent(url_a: str, url_b: str) -> bool:
     sig_a = fetch_content_signature(url_a)
     sig_b = fetch_content_signature(url_b)
-    return (sig_a == sig_b)
+    # A page that couldn't be fetched proves nothing, so it never matches
+    return sig_a is not None and sig_a == sig_b
+
+def _query_pairs(query: str) -> list:
+    """
+    Splits a raw query string into (key, "key=value") pairs. Each pair is
+    kept exactly as written, so rebuilding the query never re-encodes it.
+    """
+    return [(kv.split("=", 1)[0], kv) for kv in query.split("&") if kv]
+
+def _join_pairs(pairs) -> str:
+    """
+    Rebuilds a raw query string from _query_pairs output.
+    """
+    return "&".join(kv for _, kv in pairs)
+
+def _speculative_candidates(url: str) -> list:
+    """
+    Lists every URL canonicalize_url will probe, assuming each removal
+    turns out to be safe. Fetching these all at once up front means the
+    sequential checks below mostly hit the cache instead of the network.
+    """
+    parsed = urlparse(url)
+    candidates = [url]
+    if parsed.fragment:
+        parsed = parsed._replace(fragment="")
+        candidates.append(urlunparse(parsed))
+    if parsed.path.endswith("/") and parsed.path != "/":
+        parsed = parsed._replace(path=parsed.path.rstrip("/"))
+        candidates.append(urlunparse(parsed))
+
+    pairs = _query_pairs(parsed.query)
+    for param in TRACKING_PARAMS:
+        trimmed = [pair for pair in pairs if pair[0] != param]
+        if len(trimmed) != len(pairs):
+            pairs = trimmed
+            candidates.append(urlunparse(parsed._replace(query=_join_pairs(pairs))))
+    return candidates
+
+def _prefetch(urls) -> None:
+    """
+    Fills the _fetch_page cache for all 'urls' concurrently.
+    """
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        list(executor.map(fetch_content_signature, urls))
 
 def canonicalize_url(url: str) -> str:
+    # Most sites name their canonical URL in <link rel="canonical">. When the
+    # page does, and it stays on the same host, trust it and skip the probing
+    canonical = declared_canonical(url)
+    if canonical and urlparse(canonical).hostname == urlparse(url).hostname:
+        return canonical
+
+    # The probes are independent network round trips: run them all
+    # concurrently first, then walk through the checks in order as before.
+    # If a removal gets rejected, the later probes differ and are fetched then
+    _prefetch(_speculative_candidates(url))
+
     parsed = urlparse(url)
 
     # 1) Remove fragment if it doesn't change content
@@ -36,27 +184,19 @@ def canonicalize_url(url: str) -> str:
             parsed = test_parsed
 
     # 3) Remove known tracking params if they don't change content
-    known_tracking_params = [
-        "utm_source", "utm_medium", "utm_campaign",
-        "utm_term", "utm_content", "itm_source", "si", "originalSubdomain", "trackingId", "refId", "midToken", "trkEmail", "otpToken",
-        "midSig", "trk", "eid", "ref", "cmp", "src", "mc_eid", "mc_cid", "mc_lid", "mc_mid", "mc_rid", "mc_t", "mc_uid", "mc_lid", "mc_eid", "mc_cid",
-        # ...
-    ]
-    q_dict = parse_qs(parsed.query, keep_blank_values=True)
-
-    for param in known_tracking_params:
-        if param in q_dict:
-            removed_val = q_dict.pop(param)
-            test_query = urlencode(q_dict, doseq=True)
-            test_parsed = parsed._replace(query=test_query)
+    pairs = _query_pairs(parsed.query)
+
+    for param in TRACKING_PARAMS:
+        trimmed = [pair for pair in pairs if pair[0] != param]
+        if len(trimmed) != len(pairs):
+            test_parsed = parsed._replace(query=_join_pairs(trimmed))
             test_url = urlunparse(test_parsed)
 
-            if not pages_equivalent(url, test_url):
-                # If removing it changes the content, restore it
-                q_dict[param] = removed_val
+            # If removing it changes the content, keep it
+            if pages_equivalent(url, test_url):
+                pairs = trimmed
 
-    final_query = urlencode(q_dict, doseq=True)
-    final_parsed = parsed._replace(query=final_query)
+    final_parsed = parsed._replace(query=_join_pairs(pairs))
     return urlunparse(final_parsed)
 
 def main():
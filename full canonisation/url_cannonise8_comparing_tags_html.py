@@ -1,55 +1,225 @@
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
+import httpx
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import lxml.html
+from lxml import etree
+from urllib.parse import urlparse, urlunparse
 
-def fetch_content_signature(url: str, timeout=5):
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# One pooled HTTP/2 client for every request: the candidate URLs all sit on
+# the same host, so they are multiplexed over a single TCP/TLS connection
+# instead of handshaking for each. Connection failures get a couple of
+# retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+)
+
+# Worker threads for fetching pages concurrently: both sides of a
+# comparison, and the speculative probes in canonicalize_url
+_POOL = ThreadPoolExecutor(max_workers=8)
+
+# Query parameters that only track the visitor
+TRACKING_PARAMS = frozenset({
+    "utm_source", "utm_medium", "utm_campaign",
+    "utm_term", "utm_content", "itm_source", "si", "originalSubdomain",
+    "trackingId", "refId", "midToken", "trkEmail", "otpToken",
+    "midSig", "trk", "eid", "ref", "cmp", "src",
+    "mc_eid", "mc_cid", "mc_lid", "mc_mid", "mc_rid", "mc_t", "mc_uid",
+    # ...
+})
+
+# <title> and og:title both live in <head>, so reading stops once it has
+# ended (at </head>, or at <body> when that's left out), or as soon as both
+# tags have been read in full. Past HEAD_LIMIT bytes the <title> alone is
+# enough. A head is never cut off before its <title>, since that would make
+# every such page look untitled, and so the same
+HEAD_LIMIT = 64 * 1024
+_HEAD_END_RE = re.compile(rb"</head\s*>|<body[\s>]", re.IGNORECASE)
+_TITLE_END_RE = re.compile(rb"</title\s*>", re.IGNORECASE)
+_OG_TITLE_RE = re.compile(rb"<meta\b[^>]*og:title[^>]*>", re.IGNORECASE)
+
+def _read_head(resp) -> bytes:
+    """
+    Reads a streamed response only as far as the titles in its <head>.
+    """
+    chunks = []
+    total = 0
+    tail = b""
+    seen_title = seen_og_title = False
+    for chunk in resp.iter_bytes(16384):
+        chunks.append(chunk)
+        total += len(chunk)
+        # Search across the end of the previous chunk in case a tag is split
+        window = tail + chunk
+        if _HEAD_END_RE.search(window):
+            break
+        seen_title = seen_title or _TITLE_END_RE.search(window) is not None
+        seen_og_title = seen_og_title or _OG_TITLE_RE.search(window) is not None
+        if seen_title and (seen_og_title or total >= HEAD_LIMIT):
+            break
+        tail = chunk[-1024:]
+    return b"".join(chunks)
+
+def _parse_html(content: bytes):
+    """
+    Parses raw HTML with lxml, or returns None if the body has no markup.
+    """
+    try:
+        return lxml.html.document_fromstring(content)
+    except etree.ParserError:
+        return None
+
+@lru_cache(maxsize=256)
+def _fetch_signature(url: str):
     """
     Fetches the page and returns a signature based solely on:
       1) HTTP status code
       2) The page <title> or <meta property="og:title"> content (if present)
+    Raises on failure so that failed fetches are not cached.
     """
-    try:
-        resp = requests.get(url, allow_redirects=True, timeout=timeout)
+    with _CLIENT.stream("GET", url) as resp:
         status_code = resp.status_code
+        head = _read_head(resp)
 
-        soup = BeautifulSoup(resp.text, 'html.parser')
+    tree = _parse_html(head)
+    if tree is None:
+        return (status_code, "")
 
-        # Grab <title>
-        page_title = soup.title.string.strip() if soup.title and soup.title.string else ""
+    # Grab <title>
+    page_title = (tree.findtext(".//title") or "").strip()
 
-        # Grab <meta property="og:title">
-        og_title_tag = soup.find("meta", property="og:title")
-        og_title = og_title_tag["content"].strip() if og_title_tag and og_title_tag.has_attr("content") else ""
+    # Grab <meta property="og:title">
+    og_titles = tree.xpath('//meta[@property="og:title"]/@content')
+    og_title = og_titles[0].strip() if og_titles else ""
 
-        # Combine or choose one. Typically, "og:title" is more specific, but if missing, fall back on <title>.
-        # If you want to rely solely on og:title, you could do that; below we do fallback to <title>.
-        final_title = og_title if og_title else page_title
+    # Combine or choose one. Typically, "og:title" is more specific, but if missing, fall back on <title>.
+    # If you want to rely solely on og:title, you could do that; below we do fallback to <title>.
+    final_title = og_title if og_title else page_title
 
-        # Return a tuple (status_code, final_title) so we treat them as the "signature"
-        return (status_code, final_title)
+    # Return a tuple (status_code, final_title) so we treat them as the "signature"
+    return (status_code, final_title)
 
-    except requests.RequestException:
-        # If there's an error, return a signature unlikely to match anything else
-        return (None, "")
+def fetch_content_signature(url: str):
+    """
+    Returns the content signature from _fetch_signature, or None if the page
+    couldn't be fetched.
+    """
+    try:
+        return _fetch_signature(url)
+    except httpx.HTTPError:
+        return None
+
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _fetch_signature.cache_clear()
 
 def pages_equivalent(url_a: str, url_b: str) -> bool:
     """
     Checks if two URLs lead to the 'same' content by comparing
     only the status code + final_title (og:title or <title>).
     """
-    sig_a = fetch_content_signature(url_a)
-    sig_b = fetch_content_signature(url_b)
-    return (sig_a == sig_b)
+    # The two fetches are independent, so run them side by side
+    future_a = _POOL.submit(fetch_content_signature, url_a)
+    future_b = _POOL.submit(fetch_content_signature, url_b)
+    sig_a = future_a.result()
+    sig_b = future_b.result()
+    # A page that couldn't be fetched proves nothing, so it never matches
+    return sig_a is not None and sig_a == sig_b
+
+def _with_path(parsed):
+    """
+    Returns a function mapping a path to urlunparse(parsed._replace(path=path)).
+    The text around the path is formatted once, so each call is a plain
+    concatenation.
+    """
+    head = urlunparse((parsed.scheme, parsed.netloc, "", "", "", ""))
+    tail = urlunparse(("", "", "", parsed.params, parsed.query, parsed.fragment))
+    # urlunparse puts a '/' between the netloc and ';params' for an empty path
+    root = "/" if parsed.params else ""
+    return lambda path: head + (path or root) + tail
+
+def _query_pairs(query: str) -> list:
+    """
+    Splits a raw query string into (key, "key=value") pairs. Each pair is
+    kept exactly as written, so rebuilding the query never re-encodes it.
+    """
+    return [(kv.split("=", 1)[0], kv) for kv in query.split("&") if kv]
+
+def _join_pairs(pairs) -> str:
+    """
+    Rebuilds a raw query string from _query_pairs output.
+    """
+    return "&".join(kv for _, kv in pairs)
+
+def _path_probes(n: int):
+    """
+    Yields the prefix lengths the binary search in canonicalize_url tries
+    for a path of 'n' segments, assuming none of them can be dropped.
+    """
+    lo, hi = 1, n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        yield mid
+        lo = mid + 1
+
+def _speculative_candidates(url: str, parsed) -> list:
+    """
+    Lists the URLs canonicalize_url is likely to probe, assuming the
+    trailing slash turns out to be removable and the path can't be pruned
+    (the usual case): the O(log N) path prefixes the binary search tries,
+    and the tracking parameter probe. Fetching these all at once up front
+    means the sequential checks below mostly hit the cache instead of the
+    network.
+    'parsed' is urlparse(url), shared with canonicalize_url.
+    """
+    candidates = [url]
+    if parsed.path.endswith("/") and parsed.path != "/":
+        parsed = parsed._replace(path=parsed.path.rstrip("/"))
+        candidates.append(urlunparse(parsed))
+
+    with_path = _with_path(parsed)
+    path_parts = parsed.path.split('/')
+    for i in _path_probes(len(path_parts)):
+        candidates.append(with_path('/'.join(path_parts[:i])))
+
+    pairs = _query_pairs(parsed.query)
+    first = next((key for key, _ in pairs if key in TRACKING_PARAMS), None)
+    if first is not None:
+        kept = [pair for pair in pairs if pair[0] != first]
+        candidates.append(urlunparse(parsed._replace(query=_join_pairs(kept))))
+    return candidates
+
+def _prefetch(urls) -> None:
+    """
+    Fills the _fetch_signature cache for all 'urls' concurrently.
+    """
+    list(_POOL.map(fetch_content_signature, urls))
 
 def canonicalize_url(url: str) -> str:
-    parsed = urlparse(url)
+    # 1) Drop the fragment. It is never sent to the server, so the page can't
+    #    depend on it and there is nothing to check. The fragment-free URL is
+    #    also the reference for every comparison below
+    url = url.partition("#")[0]
 
-    # 1) Remove fragment if it doesn't change content
-    if parsed.fragment:
-        test_parsed = parsed._replace(fragment="")
-        test_url = urlunparse(test_parsed)
-        if pages_equivalent(url, test_url):
-            parsed = test_parsed
+    # The probes are independent network round trips: run them all
+    # concurrently first, then walk through the checks in order as before.
+    # If a removal gets rejected, the later probes differ and are fetched then.
+    #
+    # 'url' is parsed once here, and every candidate below is derived from
+    # this ParseResult rather than parsed again from a string
+    parsed = urlparse(url)
+    _prefetch(_speculative_candidates(url, parsed))
 
     # 2) Remove trailing slash if it doesn't change content
     if parsed.path.endswith("/") and parsed.path != "/":
@@ -59,54 +229,41 @@ def canonicalize_url(url: str) -> str:
             parsed = test_parsed
 
     # 3) Remove everything after the last '/' from right to left until content changes
+    # Only the path changes between candidates, so everything around it is
+    # formatted once and each test URL is a plain concatenation
+    with_path = _with_path(parsed)
+    # Once a prefix gives a different page, every shorter one will too, so
+    # binary search for the shortest prefix that still matches: O(log N)
+    # probes instead of one per segment. lo == len(path_parts) keeps it all
     path_parts = parsed.path.split('/')
-    for i in range(len(path_parts) - 1, 0, -1):
-        test_path = '/'.join(path_parts[:i])
-        test_parsed = parsed._replace(path=test_path)
-        test_url = urlunparse(test_parsed)
-        if pages_equivalent(url, test_url):
-            parsed = test_parsed
+    lo, hi = 1, len(path_parts)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if pages_equivalent(url, with_path('/'.join(path_parts[:mid]))):
+            hi = mid
         else:
-            break
+            lo = mid + 1
+    parsed = parsed._replace(path='/'.join(path_parts[:lo]))
 
     # 4) Remove all known tracking params and everything after them
-    known_tracking_params = [
-        "utm_source", "utm_medium", "utm_campaign",
-        "utm_term", "utm_content", "itm_source", "si", "originalSubdomain",
-        "trackingId", "refId", "midToken", "trkEmail", "otpToken",
-        "midSig", "trk", "eid", "ref", "cmp", "src",
-        "mc_eid", "mc_cid", "mc_lid", "mc_mid", "mc_rid", "mc_t", "mc_uid",
-        # ...
-    ]
-    q_dict = parse_qs(parsed.query, keep_blank_values=True)
-    removed_params = {}
-
-    for param in known_tracking_params:
-        if param in q_dict:
-            removed_params[param] = q_dict.pop(param)
-            # Stop after removing the first known tracking parameter
-            break
+    # The query is kept as the raw (key, "key=value") pairs it was written
+    # with: removing a param is a list filter, and the string is joined once
+    # per probe instead of re-encoding the whole query with urlencode
+    pairs = _query_pairs(parsed.query)
+
+    # Stop after removing the first known tracking parameter in the query.
+    # The set lookup only checks the params actually present in the URL
+    first = next((key for key, _ in pairs if key in TRACKING_PARAMS), None)
+    if first is not None:
+        test_parsed = parsed._replace(
+            query=_join_pairs(pair for pair in pairs if pair[0] != first)
+        )
+
+        # 5) Keep it removed only if the content doesn't change
+        if pages_equivalent(url, urlunparse(test_parsed)):
+            parsed = test_parsed
 
-    # Remove everything after the first known tracking parameter
-    test_query = urlencode(q_dict, doseq=True)
-    test_parsed = parsed._replace(query=test_query)
-    test_url = urlunparse(test_parsed)
-
-    # 5) Check if content changes after removing all tracking params
-    if not pages_equivalent(url, test_url):
-        # Restore parameters one by one if content changes
-        for param, value in removed_params.items():
-            q_dict[param] = value
-            test_query = urlencode(q_dict, doseq=True)
-            test_parsed = parsed._replace(query=test_query)
-            test_url = urlunparse(test_parsed)
-
-            if pages_equivalent(url, test_url):
-                q_dict.pop(param)
-
-    final_query = urlencode(q_dict, doseq=True)
-    final_parsed = parsed._replace(query=final_query)
-    return urlunparse(final_parsed)
+    return urlunparse(parsed)
 
 def main():
     original_url = (
@@ -1,57 +1,91 @@
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import (
-    urlparse, urlunparse, parse_qs, urlencode
+import httpx
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import lxml.html
+from lxml import etree
+from urllib.parse import urlparse, urlunparse
+
+# Fixed so that the URL alone is the cache key below
+REQUEST_TIMEOUT = 5
+
+# One pooled HTTP/2 client for every request: the candidate URLs all sit on
+# the same host, so they are multiplexed over a single TCP/TLS connection
+# instead of handshaking for each. Connection failures get a couple of
+# retries before we give up on a URL
+_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    ),
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+)
+
+# Worker threads for fetching pages concurrently: both sides of a
+# comparison, and the speculative probes in canonicalize_url
+_POOL = ThreadPoolExecutor(max_workers=8)
+
+# Query parameters that only track the visitor
+TRACKING_PARAMS = frozenset({
+    "utm_source","utm_medium","utm_campaign","utm_term","utm_content",
+    "itm_source","si","trackingId","refId","midToken","midSig",
+    "trkEmail","otpToken","eid","mc_eid","mc_cid","mc_lid","mc_mid","mc_rid",
+    "mc_t","mc_uid","trk",
+})
+
+# <meta name="..."> tags that store dynamic tracking or IDs
+EPHEMERAL_META_NAMES = frozenset({
+    "bprPageInstance", "clientPageInstanceId", "applicationInstance",
+    "requestIpCountryCode", "serviceInstance", "serviceVersion",
+    "treeID",  # etc.
+})
+
+# Compiled once: each finds every match in a single C-level sweep of the tree
+_NONCE_XPATH = etree.XPath("//*[@nonce]")
+_EPHEMERAL_META_XPATH = etree.XPath(
+    "//meta[" + " or ".join(f"@name='{name}'" for name in sorted(EPHEMERAL_META_NAMES)) + "]"
 )
 
-def strip_ephemeral_content(soup: BeautifulSoup) -> None:
+def strip_ephemeral_content(tree) -> None:
     """
     Remove or sanitize dynamic and tracking-related elements in-place.
     This is fairly aggressive and LinkedIn-specific.
+    'tree' is an lxml.html document.
     """
 
     #
-    # 1) Remove all <script> tags entirely
+    # 1) Remove all <script> tags entirely (the text after them stays)
     #
-    for s in soup.find_all("script"):
-        s.decompose()
+    etree.strip_elements(tree, "script", with_tail=False)
 
     #
     # 2) Remove any 'nonce' attributes from remaining tags
     #
-    for tag in soup.find_all(attrs={"nonce": True}):
-        del tag["nonce"]
+    for tag in _NONCE_XPATH(tree):
+        del tag.attrib["nonce"]
 
     #
     # 3) Remove known ephemeral <meta> tags that store dynamic tracking or IDs
     #
-    ephemeral_meta_names = {
-        "bprPageInstance", "clientPageInstanceId", "applicationInstance",
-        "requestIpCountryCode", "serviceInstance", "serviceVersion",
-        "treeID",  # etc.
-    }
-    for meta in soup.find_all("meta"):
-        if meta.get("name", "") in ephemeral_meta_names:
-            meta.decompose()
+    for meta in _EPHEMERAL_META_XPATH(tree):
+        meta.drop_tree()
 
     #
     # 4) Optionally remove <meta> tags that have a "content" containing dynamic strings
     #    e.g., if you see dynamic timestamps or random IDs. This is site-specific.
     #
-    # for meta in soup.find_all("meta"):
-    #     content_val = meta.get("content", "")
-    #     if "random" in content_val or "token" in content_val:
-    #         meta.decompose()
+    # for meta in tree.xpath('//meta[contains(@content, "random") or contains(@content, "token")]'):
+    #     meta.drop_tree()
 
     #
     # 5) Remove certain <link> tags that might hold ephemeral references
     #    For example, if you see a pattern like trk= or refId= in the href.
     #    This is optional and site-specific.
     #
-    # for link_tag in soup.find_all("link", href=True):
-    #     href_val = link_tag["href"]
-    #     if any(param in href_val for param in ["trk=", "refId=", "token="]):
-    #         link_tag.decompose()
+    # for link_tag in tree.xpath('//link[contains(@href, "trk=") or contains(@href, "refId=") or contains(@href, "token=")]'):
+    #     link_tag.drop_tree()
 
     #
     # 6) Possibly remove or sanitize other dynamic tags, hidden inputs, or IDs
@@ -59,34 +93,111 @@ def strip_ephemeral_content(soup: BeautifulSoup) -> None:
     #    e.g., remove <img> with dynamic query tokens, or remove data-* attributes, etc.
     #
 
-def fetch_stripped_html(url: str, timeout=5) -> str:
+def _stripped_html(url: str, timeout) -> str:
     """
-    Fetches the page from 'url', then strips out ephemeral or dynamic
-    LinkedIn-specific elements. Returns the "cleaned" HTML string.
+    fetch_stripped_html without the error handling: raises httpx.HTTPError
+    if the page can't be fetched.
     """
-    try:
-        resp = requests.get(url, allow_redirects=True, timeout=timeout)
-        resp.raise_for_status()
+    resp = _CLIENT.get(url, timeout=timeout)
+    resp.raise_for_status()
 
-        soup = BeautifulSoup(resp.text, "html.parser")
+    try:
+        tree = lxml.html.document_fromstring(resp.content)
+    except etree.ParserError:
+        # Nothing to strip in a page without markup
+        return ""
 
-        # Strip ephemeral dynamic bits
-        strip_ephemeral_content(soup)
+    # Strip ephemeral dynamic bits
+    strip_ephemeral_content(tree)
 
-        # Return the final, cleaned HTML
-        return str(soup)
+    # Return the final, cleaned HTML
+    return etree.tostring(tree, method="html", encoding="unicode")
 
-    except requests.RequestException:
+def fetch_stripped_html(url: str, timeout=REQUEST_TIMEOUT) -> str:
+    """
+    Fetches the page from 'url', then strips out ephemeral or dynamic
+    LinkedIn-specific elements. Returns the "cleaned" HTML string,
+    or "" if the page can't be fetched.
+    """
+    try:
+        return _stripped_html(url, timeout)
+    except httpx.HTTPError:
         return ""
 
+@lru_cache(maxsize=256)
+def _stripped_digest(url: str) -> bytes:
+    """
+    16-byte BLAKE2b digest of the cleaned page. This is what gets cached
+    and compared, rather than the cleaned pages themselves.
+    Raises on failure so that failed fetches are not cached.
+    """
+    return hashlib.blake2b(_stripped_html(url, REQUEST_TIMEOUT).encode("utf-8"), digest_size=16).digest()
+
+def fetch_stripped_digest(url: str):
+    """
+    Returns the digest from _stripped_digest, or None if the page couldn't
+    be fetched.
+    """
+    try:
+        return _stripped_digest(url)
+    except httpx.HTTPError:
+        return None
+
+def _clear_caches():
+    """
+    Forgets every cached result, for long-running use where pages may change.
+    """
+    _stripped_digest.cache_clear()
+
 def pages_equivalent(url_a: str, url_b: str) -> bool:
     """
     Compare two URLs by fetching them and comparing their
-    'cleaned' HTML (after removing ephemeral bits).
+    'cleaned' HTML (after removing ephemeral bits), by digest.
+    """
+    # The two fetches are independent, so run them side by side
+    future_a = _POOL.submit(fetch_stripped_digest, url_a)
+    future_b = _POOL.submit(fetch_stripped_digest, url_b)
+    digest_a = future_a.result()
+    digest_b = future_b.result()
+    # A page that couldn't be fetched proves nothing, so it never matches
+    return digest_a is not None and digest_a == digest_b
+
+def _query_pairs(query: str) -> list:
+    """
+    Splits a raw query string into (key, "key=value") pairs. Each pair is
+    kept exactly as written, so rebuilding the query never re-encodes it.
+    """
+    return [(kv.split("=", 1)[0], kv) for kv in query.split("&") if kv]
+
+def _join_pairs(pairs) -> str:
+    """
+    Rebuilds a raw query string from _query_pairs output.
+    """
+    return "&".join(kv for _, kv in pairs)
+
+def _speculative_candidates(url: str, parsed) -> list:
+    """
+    Lists every URL canonicalize_url will probe, assuming each removal
+    turns out to be safe. Fetching these all at once up front means the
+    sequential checks below mostly hit the cache instead of the network.
+    'parsed' is urlparse(url), shared with canonicalize_url.
     """
-    cleaned_a = fetch_stripped_html(url_a)
-    cleaned_b = fetch_stripped_html(url_b)
-    return (cleaned_a == cleaned_b)
+    candidates = [url]
+    if parsed.path.endswith("/") and parsed.path != "/":
+        parsed = parsed._replace(path=parsed.path.rstrip("/"))
+        candidates.append(urlunparse(parsed))
+
+    pairs = _query_pairs(parsed.query)
+    kept = [pair for pair in pairs if pair[0] not in TRACKING_PARAMS]
+    if len(kept) != len(pairs):
+        candidates.append(urlunparse(parsed._replace(query=_join_pairs(kept))))
+    return candidates
+
+def _prefetch(urls) -> None:
+    """
+    Fills the _stripped_digest cache for all 'urls' concurrently.
+    """
+    list(_POOL.map(fetch_stripped_digest, urls))
 
 def canonicalize_url(url: str) -> str:
     """
@@ -94,14 +205,19 @@ def canonicalize_url(url: str) -> str:
     and known tracking parameters. It uses 'pages_equivalent' with
     stripped HTML to confirm the pages remain the same.
     """
-    parsed = urlparse(url)
+    # 1) Drop the fragment. It is never sent to the server, so the page can't
+    #    depend on it and there is nothing to check. The fragment-free URL is
+    #    also the reference for every comparison below
+    url = url.partition("#")[0]
 
-    # 1) Remove fragment if it doesn't alter content
-    if parsed.fragment:
-        test_parsed = parsed._replace(fragment="")
-        test_url = urlunparse(test_parsed)
-        if pages_equivalent(url, test_url):
-            parsed = test_parsed
+    # The probes are independent network round trips: run them all
+    # concurrently first, then walk through the checks in order as before.
+    # If a removal gets rejected, the later probes differ and are fetched then.
+    #
+    # 'url' is parsed once here, and every candidate below is derived from
+    # this ParseResult rather than parsed again from a string
+    parsed = urlparse(url)
+    _prefetch(_speculative_candidates(url, parsed))
 
     # 2) Remove trailing slash if safe
     if parsed.path.endswith("/") and parsed.path != "/":
@@ -111,24 +227,15 @@ def canonicalize_url(url: str) -> str:
             parsed = test_parsed
 
     # 3) Remove known tracking parameters
-    tracking_params = [
-        "utm_source","utm_medium","utm_campaign","utm_term","utm_content",
-        "itm_source","si","trackingId","refId","midToken","midSig",
-        "trkEmail","otpToken","eid","mc_eid","mc_cid","mc_lid","mc_mid","mc_rid",
-        "mc_t","mc_uid","trk",
-    ]
-    q = parse_qs(parsed.query, keep_blank_values=True)
+    # The query is kept as the raw (key, "key=value") pairs it was written
+    # with, so the kept params come back out exactly as they went in
+    pairs = _query_pairs(parsed.query)
 
     # We'll remove them all at once, but we could do them one by one if we want finer control
-    removed_any = False
-    for param in tracking_params:
-        if param in q:
-            del q[param]
-            removed_any = True
-
-    if removed_any:
-        test_query = urlencode(q, doseq=True)
-        test_parsed = parsed._replace(query=test_query)
+    kept = [pair for pair in pairs if pair[0] not in TRACKING_PARAMS]
+
+    if len(kept) != len(pairs):
+        test_parsed = parsed._replace(query=_join_pairs(kept))
         test_url = urlunparse(test_parsed)
 
         # If the cleaned pages are the same, keep them removed
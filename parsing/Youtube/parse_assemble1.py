@@ -1,22 +1,30 @@
-import re
-from urllib.parse import urlparse
+# Characters that end a video ID
+_V_DELIMITERS = "&#/?"
 
 def get_video_id_custom(url: str) -> str:
     """
     This function looks for 'v=' in the URL's query and captures
     everything until it hits &, #, or /.
     """
-    parsed = urlparse(url)
-    query_str = parsed.query  # e.g., "v=abc123#blah" or "v=abc123&foo=bar"
+    # The query is whatever sits between the first '?' and the fragment,
+    # exactly as urlparse splits it, without building a whole ParseResult
+    query_str = url.partition("#")[0].partition("?")[2]  # e.g., "v=abc123&foo=bar"
 
-    # Our regex looks for v= then captures all non-&/#/ characters
-    pattern = re.compile(r"v=([^&#/?]+)")
-    match = pattern.search(query_str)
-    if match:
-        # group(1) is what was captured between 'v=' and the special character
-        return match.group(1)
-    else:
-        return ""
+    # Plain str.find scans instead of a regex: find 'v=', then cut at the
+    # nearest special character. An empty value doesn't count, so keep
+    # looking for the next 'v=' in that case
+    start = query_str.find("v=")
+    while start >= 0:
+        start += 2
+        end = len(query_str)
+        for ch in _V_DELIMITERS:
+            k = query_str.find(ch, start, end)
+            if k >= 0:
+                end = k
+        if end > start:
+            return query_str[start:end]
+        start = query_str.find("v=", start)
+    return ""
 
 # Example usage:
 test_urls = [